@@ -15,3 +15,14 @@ PORT=random.randint(5000,8000)
 DEBUG = False # Because it's unsafe to run outside localhost
 GOOGLE_LICENSE_KEY = ".goog_app_key.json"
 
+
+### Directory for the on-disk busy-interval store (None to disable)
+BUSY_STORE_DIR = None
+
+### Server-side caches and background prefetching
+CACHE_TTL = 300       # Seconds a fetched calendar list or busy time is reused
+PREFETCH_JOBS = 4     # Prefetch jobs running at once (per process)
+
+### Google API calls per second (and burst) allowed to each process
+GCAL_RATE = 10
+GCAL_BURST = 20
@@ -9,6 +9,23 @@
 
 import datetime
 import arrow
+import array
+import functools
+import struct
+import sys
+
+# Compact binary form of an agenda (see Agenda.dumps):
+#   header:  magic, version, flags, reserved, base epoch, count
+#   body:    2 * count little-endian int32 deltas, for each appointment
+#            (begin - previous end, end - begin); the first begin is
+#            relative to the base epoch.
+# Times are whole seconds since the epoch; descriptions are not kept.
+PACK_MAGIC = b"AGDA"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<4sBBHqI")
+
+# Distinct (date range, daily hours, time zone) masks kept by working_hours
+WORKING_HOURS_CACHE_SIZE = 256
 
 class Appt:
     """
@@ -169,6 +186,29 @@ class Agenda:
         
         return result
 
+    def intersect_normalized(self, other, desc=""):
+        """Like intersect, but in one merging pass over the normalized
+        appointments of both agendas rather than comparing every pair.
+        The result is normalized.
+
+        Arguments:
+           other: Another Agenda, to be intersected with this one
+           desc:  If provided, this string becomes the title of
+                all the appointments in the result.
+        """
+        mine = self.normalized().appts
+        theirs = other.normalized().appts
+        result = Agenda()
+        i = j = 0
+        while i < len(mine) and j < len(theirs):
+            if mine[i].overlaps(theirs[j]):
+                result.append(mine[i].intersect(theirs[j], desc))
+            if mine[i].end < theirs[j].end:
+                i += 1
+            else:
+                j += 1
+        return result
+
     def normalize(self):
         """Merge overlapping events in an agenda. For example, if 
         the first appointment is from 1pm to 3pm, and the second is
@@ -244,6 +284,65 @@ class Agenda:
         return comp
 
 
+    def difference(self, other):
+        """Produce the times covered by this agenda and not by
+        the other: for example, working hours minus busy times
+        are free times.  Runs in one pass over both (normalized)
+        agendas.
+        Args:
+           other: Another Agenda
+        Returns:
+           A new, normalized agenda.  Descriptions come from the
+           appointments of this agenda.
+        """
+        mine = self.normalized().appts
+        theirs = other.normalized().appts
+        result = Agenda()
+        i = 0
+        for appt in mine:
+            cur_time = appt.begin
+            while i < len(theirs) and theirs[i].end <= cur_time:
+                i += 1
+            j = i
+            while j < len(theirs) and theirs[j].begin < appt.end:
+                if cur_time < theirs[j].begin:
+                    result.append(Appt(cur_time, theirs[j].begin, appt.desc))
+                cur_time = max(cur_time, theirs[j].end)
+                j += 1
+            if cur_time < appt.end:
+                result.append(Appt(cur_time, appt.end, appt.desc))
+        return result
+
+    def dumps(self):
+        """Serialize to the compact binary form described at the top
+        of this module.  Appointment descriptions are dropped and
+        times are truncated to whole seconds.
+
+        Returns:
+           bytes
+        Raises:
+           ValueError if two consecutive times are more than
+           2**31 seconds apart.
+        """
+        return pack_intervals((appt.begin.timestamp, appt.end.timestamp)
+                              for appt in self.appts)
+
+    @classmethod
+    def loads(cls, buf, tz="local", desc=""):
+        """Build an agenda from the output of Agenda.dumps.
+
+        Arguments:
+           buf:  bytes-like object holding a packed agenda
+           tz:   time zone the appointments are converted to
+           desc: description given to every appointment
+        Raises:
+           ValueError if buf is not a packed agenda
+        """
+        result = cls()
+        for begin, end in iter_packed(buf):
+            result.append(Appt(arrow.get(begin).to(tz),
+                               arrow.get(end).to(tz), desc))
+        return result
 
     def __len__(self):
         """Number of appointments, callable as built-in len() function"""
@@ -272,5 +371,165 @@ class Agenda:
                 return False
         return True
 
-    
-    
+
+def working_hours(first_day, last_day, begin, end, tz="local", desc=""):
+    """The daily windows from 'begin' to 'end' o'clock, every day
+    from first_day through last_day, as a normalized agenda.  Each
+    window is placed in 'tz' on its own day, so windows keep their
+    wall-clock hours across daylight saving changes.
+
+    Windows are memoized (see WORKING_HOURS_CACHE_SIZE), so repeated
+    queries over the same range do not rebuild them; each call still
+    returns its own agenda and appointments.
+
+    Arguments:
+       first_day, last_day: datetime.date
+       begin, end: datetime.time, wall-clock hours in tz
+       tz:   time zone name, as understood by arrow
+       desc: description of the windows
+    Raises:
+       ValueError if end is not after begin, or last_day is
+       before first_day
+    """
+    if end <= begin:
+        raise ValueError("Working hours must end after they begin")
+    if last_day < first_day:
+        raise ValueError("Date range must not end before it begins")
+    result = Agenda()
+    for window in _working_hours(first_day, last_day, begin, end, tz, desc):
+        result.append(Appt(window.begin, window.end, window.desc))
+    return result
+
+
+@functools.lru_cache(maxsize=WORKING_HOURS_CACHE_SIZE)
+def _working_hours(first_day, last_day, begin, end, tz, desc):
+    """Memoized part of working_hours; returns a tuple of Appt."""
+    windows = [ ]
+    day = first_day
+    while day <= last_day:
+        window_begin = arrow.get(datetime.datetime.combine(day, begin)).replace(tzinfo=tz)
+        window_end = arrow.get(datetime.datetime.combine(day, end)).replace(tzinfo=tz)
+        windows.append(Appt(window_begin, window_end, desc))
+        day += datetime.timedelta(days=1)
+    return tuple(windows)
+
+
+def pack_intervals(intervals):
+    """Pack (begin, end) epoch-second pairs in the binary form
+    read by iter_packed and Agenda.loads.
+
+    Raises:
+       ValueError if two consecutive times are more than
+       2**31 seconds apart.
+    """
+    deltas = array.array("i")
+    base = None
+    count = 0
+    try:
+        for begin, end in intervals:
+            if base is None:
+                base = prev = begin
+            deltas.append(begin - prev)
+            deltas.append(end - begin)
+            prev = end
+            count += 1
+    except OverflowError:
+        raise ValueError("Intervals span too long a time to pack")
+    if sys.byteorder != "little":
+        deltas.byteswap()
+    header = PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, 0,
+                              base or 0, count)
+    return header + deltas.tobytes()
+
+
+def iter_packed(buf):
+    """Iterate over the (begin, end) epoch-second pairs of a packed
+    agenda (see Agenda.dumps) without copying or building Appt objects.
+
+    Arguments:
+       buf: bytes-like object (bytes, bytearray, mmap, memoryview)
+    Raises:
+       ValueError if buf is not a packed agenda
+    """
+    view = memoryview(buf)
+    if len(view) < PACK_HEADER.size:
+        raise ValueError("Packed agenda is truncated")
+    magic, version, flags, reserved, base, count = \
+        PACK_HEADER.unpack_from(view)
+    if magic != PACK_MAGIC or version != PACK_VERSION:
+        raise ValueError("Not a packed agenda")
+    body = view[PACK_HEADER.size:PACK_HEADER.size + 8 * count]
+    if len(body) != 8 * count:
+        raise ValueError("Packed agenda is truncated")
+    if sys.byteorder == "little":
+        deltas = body.cast("i")
+    else:
+        deltas = array.array("i", body.tobytes())
+        deltas.byteswap()
+    stamp = base
+    for i in range(0, 2 * count, 2):
+        begin = stamp + deltas[i]
+        stamp = begin + deltas[i + 1]
+        yield begin, stamp
+
+
+def free_count_grid(agendas, begin, end, minutes=30):
+    """Count, for each fixed-length slot between begin and end, how many
+    of the agendas are free for the whole slot.  A slot touched by any
+    appointment of an agenda counts as busy for that agenda.
+
+    Busy slots are accumulated in a difference array and summed once,
+    so the cost is linear in the number of appointments plus slots.
+
+    Arguments:
+       agendas: a list of Agenda, one per calendar, of busy times
+       begin, end: arrow objects bounding the grid; slots start at begin
+       minutes: slot length
+    Returns:
+       A list with one free count (0 .. len(agendas)) per slot
+    """
+    slot = minutes * 60
+    start = begin.timestamp
+    slots = -((start - end.timestamp) // slot)    # rounded up
+    diff = [0] * (slots + 1)
+    for agenda in agendas:
+        marked = 0    # slots before this are already counted busy
+        for appt in agenda.normalized():
+            first = max((appt.begin.timestamp - start) // slot, marked)
+            stop = min(-((start - appt.end.timestamp) // slot), slots)
+            if first < stop:
+                diff[first] += 1
+                diff[stop] -= 1
+                marked = stop
+    counts = [ ]
+    busy = 0
+    for i in range(slots):
+        busy += diff[i]
+        counts.append(len(agendas) - busy)
+    return counts
+
+
+def free_slots(counts, least, begin, end, minutes=30, desc=""):
+    """The periods in a free-count grid where at least 'least'
+    calendars are free.
+
+    Arguments:
+       counts: a grid from free_count_grid
+       least: minimum number of free calendars
+       begin, end, minutes: as given to free_count_grid
+       desc: description of the resulting appointments
+    Returns:
+       A normalized Agenda of the qualifying periods
+    """
+    result = Agenda()
+    run = None
+    for i, count in enumerate(counts + [-1]):
+        if count >= least:
+            if run is None:
+                run = i
+        elif run is not None:
+            run_begin = begin.replace(minutes=+minutes * run)
+            run_end = min(begin.replace(minutes=+minutes * i), end)
+            result.append(Appt(run_begin, run_end, desc))
+            run = None
+    return result
@@ -0,0 +1,225 @@
+"""
+Batch availability: free times of many calendars over a date range,
+computed outside the web app.
+
+   python3 batch.py --range "11/14/2016 - 11/18/2016" --begin 09:00 --end 17:00
+                    (--busy FILE ... | --store DIR --calendars ID ... | --fake N)
+                    [--processes P] [--output FILE]
+
+Busy times come from JSON files ({calendar id: [[start, end], ...]} with
+ISO-8601 times), from the on-disk busy store the web app fills from its
+freebusy fetches (busystore.py; every calendar must have been fetched
+for the whole range), or from synthetic calendars.  The
+per-calendar normalize/complement work and the intersection of the
+results are spread over a process pool; intervals travel between the
+processes in the packed form of agenda.pack_intervals.
+
+The output is JSON lines: one {"calendar": id, "free": [...]} per
+calendar, then {"common": [...]} with the times every calendar is free.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import random
+import sys
+
+import arrow
+from agenda import pack_intervals, iter_packed, working_hours
+from busystore import (BusyStore, normalize_intervals, subtract_intervals,
+                       intersect_intervals)
+
+
+def daily_windows(daterange, begin_time, end_time, tz="local"):
+    """The (begin, end) epoch-second pairs of the daily time windows.
+
+    Arguments:
+       daterange:  "MM/DD/YYYY - MM/DD/YYYY", as from the range widget
+       begin_time, end_time: "HH:mm" wall-clock times
+       tz:         time zone the wall-clock times are in
+    """
+    first, last = [datetime.datetime.strptime(date, "%m/%d/%Y").date()
+                   for date in daterange.split(" - ")]
+    begin = datetime.datetime.strptime(begin_time, "%H:%M").time()
+    end = datetime.datetime.strptime(end_time, "%H:%M").time()
+    return [(window.begin.timestamp, window.end.timestamp)
+            for window in working_hours(first, last, begin, end, tz)]
+
+
+def fake_busy(count, windows, seed=0):
+    """Synthetic busy data: 'count' calendars with a few meetings of
+    15 minutes to 2 hours in every window."""
+    rand = random.Random(seed)
+    calendars = { }
+    for n in range(count):
+        busy = [ ]
+        for begin, end in windows:
+            for i in range(rand.randint(0, 6)):
+                start = rand.randrange(begin, end, 900)
+                busy.append((start, start + 900 * rand.randint(1, 8)))
+        calendars["fake{}@example.com".format(n)] = busy
+    return calendars
+
+
+def stored_busy(store, calendar_ids, windows):
+    """Busy times of calendars from the busy store, packed.
+
+    Arguments:
+       store:        a BusyStore
+       calendar_ids: calendar ids to read
+       windows:      normalized (begin, end) epoch-second pairs
+    Returns:
+       list of (calendar id, packed busy times) pairs
+    Raises:
+       ValueError naming the calendars whose fetches have not covered
+       every window, rather than passing the unknown times off as free
+    """
+    unknown = [calendar_id for calendar_id in calendar_ids
+               if not all(store.covers(calendar_id, begin, end)
+                          for begin, end in windows)]
+    if unknown:
+        raise ValueError("No stored busy times for all of the range: {}"
+                         .format(", ".join(unknown)))
+    span_begin, span_end = windows[0][0], windows[-1][1]
+    return [(calendar_id, pack_intervals(
+                 store.intervals(calendar_id, span_begin, span_end)))
+            for calendar_id in calendar_ids]
+
+
+def _epoch(time):
+    """Epoch seconds from an int or an ISO-8601 string"""
+    if isinstance(time, int):
+        return time
+    return arrow.get(time).timestamp
+
+
+def _free_chunk(task):
+    """Worker: free times of each calendar in a chunk, and the times
+    every calendar in the chunk is free.
+
+    Arguments:
+       task: (windows, [(calendar id, busy), ...]) where busy is
+             packed, or a list of (begin, end) ISO strings or epochs
+    Returns:
+       ([(calendar id, packed free times), ...], packed common times)
+    """
+    windows, chunk = task
+    free_times = [ ]
+    common = windows
+    for calendar_id, busy in chunk:
+        if isinstance(busy, bytes):
+            busy = iter_packed(busy)
+        else:
+            busy = [(_epoch(begin), _epoch(end)) for begin, end in busy]
+        free = subtract_intervals(windows, normalize_intervals(busy))
+        common = intersect_intervals(common, free)
+        free_times.append((calendar_id, pack_intervals(free)))
+    return free_times, pack_intervals(common)
+
+
+def compute(calendars, windows, processes=None, progress=None):
+    """Free times of many calendars within the same windows.
+
+    Arguments:
+       calendars: list of (calendar id, busy) pairs; see _free_chunk
+       windows:   normalized (begin, end) epoch-second pairs
+       processes: pool size (default: one per core)
+       progress:  optional callable(done, total), called as calendars
+                  are finished
+    Returns:
+       (free, common): a dict of calendar id to free (begin, end) pairs,
+       and the pairs during which every calendar is free
+    """
+    processes = processes or multiprocessing.cpu_count()
+    size = max(1, len(calendars) // (processes * 4))
+    tasks = [(windows, calendars[i:i + size])
+             for i in range(0, len(calendars), size)]
+    free = { }
+    common = windows
+    with multiprocessing.Pool(processes) as pool:
+        for free_times, chunk_common in pool.imap_unordered(_free_chunk, tasks):
+            for calendar_id, packed in free_times:
+                free[calendar_id] = list(iter_packed(packed))
+            common = intersect_intervals(common, list(iter_packed(chunk_common)))
+            if progress:
+                progress(len(free), len(calendars))
+    return free, common
+
+
+def report_progress(done, total):
+    """Progress line on stderr"""
+    sys.stderr.write("\r{}/{} calendars".format(done, total))
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def write_results(out, free, common, tz="local"):
+    """Write the JSON-lines results in one go."""
+    def isoformat(intervals):
+        return [[arrow.get(begin).to(tz).isoformat(),
+                 arrow.get(end).to(tz).isoformat()]
+                for begin, end in intervals]
+    lines = [json.dumps({"calendar": calendar_id, "free": isoformat(times)})
+             for calendar_id, times in sorted(free.items())]
+    lines.append(json.dumps({"common": isoformat(common)}))
+    out.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Free times of many calendars over a date range")
+    parser.add_argument("--range", required=True,
+                        help='dates, as "MM/DD/YYYY - MM/DD/YYYY"')
+    parser.add_argument("--begin", required=True, help="daily start, HH:mm")
+    parser.add_argument("--end", required=True, help="daily end, HH:mm")
+    parser.add_argument("--tz", default="local", help="time zone of the times")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--busy", nargs="+", metavar="FILE",
+                        help="JSON files of busy times by calendar id")
+    source.add_argument("--store", metavar="DIR", help="busy store directory")
+    source.add_argument("--fake", type=int, metavar="N",
+                        help="use N synthetic calendars")
+    parser.add_argument("--calendars", nargs="+", metavar="ID",
+                        help="calendar ids to read from the store")
+    parser.add_argument("--processes", type=int, help="pool size")
+    parser.add_argument("--output", help="results file (default: stdout)")
+    parser.add_argument("--quiet", action="store_true", help="no progress")
+    args = parser.parse_args()
+
+    try:
+        windows = normalize_intervals(
+            daily_windows(args.range, args.begin, args.end, args.tz))
+    except ValueError as error:
+        parser.error(str(error))
+    if args.busy:
+        calendars = [ ]
+        for name in args.busy:
+            with open(name) as f:
+                calendars.extend(json.load(f).items())
+    elif args.store:
+        if not args.calendars:
+            parser.error("--store needs --calendars")
+        store = BusyStore(args.store)
+        try:
+            calendars = stored_busy(store, args.calendars, windows)
+        except ValueError as error:
+            parser.error(str(error))
+        finally:
+            store.close()
+    else:
+        calendars = [(calendar_id, pack_intervals(busy)) for calendar_id, busy
+                     in fake_busy(args.fake, windows).items()]
+
+    progress = None if args.quiet else report_progress
+    free, common = compute(calendars, windows, args.processes, progress)
+    if args.output:
+        with open(args.output, "w") as out:
+            write_results(out, free, common, args.tz)
+    else:
+        write_results(sys.stdout, free, common, args.tz)
+
+
+if __name__ == "__main__":
+    main()
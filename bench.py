@@ -0,0 +1,207 @@
+"""
+Benchmarks for the free/busy machinery.
+
+   python3 bench.py serialize [--appts N] [--repeat R]
+   python3 bench.py batch [--calendars N] [--days D] [--processes P ...]
+   python3 bench.py startup [--budget MS] [--top N]
+   python3 bench.py render [--calendars N] [--days D] [--budget MS]
+
+Each benchmark prints one line per measurement so the output can be
+collected into bench_output.txt and compared between runs.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import timeit
+
+import arrow
+from agenda import *
+import batch
+
+
+def sample_agenda(count):
+    """An agenda of 'count' one-hour appointments, one every three hours."""
+    start = arrow.get("2016-11-01T09:00:00-07:00")
+    schedule = Agenda()
+    for i in range(count):
+        begin = start.replace(hours=+3 * i)
+        schedule.append(Appt(begin, begin.replace(hours=+1), ""))
+    return schedule
+
+
+def bench_serialize(args):
+    """Packed binary form vs. the JSON list of ISO strings we store today."""
+    schedule = sample_agenda(args.appts)
+    as_json = json.dumps([appt.get_isoformat() for appt in schedule])
+    as_packed = schedule.dumps()
+
+    def json_decode():
+        return [[arrow.get(begin), arrow.get(end)]
+                for begin, end in json.loads(as_json)]
+
+    cases = [
+        ("json", len(as_json),
+         lambda: json.dumps([appt.get_isoformat() for appt in schedule]),
+         json_decode),
+        ("packed", len(as_packed), schedule.dumps,
+         lambda: Agenda.loads(as_packed)),
+        ("packed-view", len(as_packed), schedule.dumps,
+         lambda: list(iter_packed(as_packed))),
+    ]
+    print("{} appointments, best of {}".format(args.appts, args.repeat))
+    for name, size, encode, decode in cases:
+        enc = min(timeit.repeat(encode, number=1, repeat=args.repeat))
+        dec = min(timeit.repeat(decode, number=1, repeat=args.repeat))
+        print("{:12} {:8d} bytes {:6.1f} B/appt  encode {:8.2f} ms  "
+              "decode {:8.2f} ms".format(name, size, size / args.appts,
+                                          enc * 1000, dec * 1000))
+
+
+def bench_batch(args):
+    """Scaling of the batch availability computation over pool sizes."""
+    windows = batch.daily_windows("11/01/2016 - 11/01/2016", "09:00", "17:00")
+    first = windows[0]
+    windows = [(first[0] + day * 86400, first[1] + day * 86400)
+               for day in range(args.days)]
+    calendars = [(calendar_id, pack_intervals(busy)) for calendar_id, busy
+                 in batch.fake_busy(args.calendars, windows).items()]
+    print("{} calendars over {} days".format(args.calendars, args.days))
+    base = None
+    for processes in args.processes:
+        started = time.perf_counter()
+        batch.compute(calendars, windows, processes)
+        elapsed = time.perf_counter() - started
+        base = base or elapsed
+        print("{:3d} processes  {:8.2f} s  speedup {:5.2f}".format(
+            processes, elapsed, base / elapsed))
+
+
+# Import time (ms) allowed for 'import main; main.create_app()'
+STARTUP_BUDGET_MS = 350
+
+
+def bench_startup(args):
+    """Cold-start cost of the web app, from python -X importtime."""
+    command = [sys.executable, "-X", "importtime", "-c",
+               "import main; main.create_app()"]
+    run = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    if run.returncode != 0:
+        sys.exit(run.stderr)
+    # Lines look like "import time:  self [us] | cumulative | imported package",
+    # with nested imports indented two spaces per level, listed before
+    # the package that imported them.
+    children = [ ]
+    for line in run.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level == 1:
+            children.append((int(cumulative), name.strip()))
+        elif level == 0:
+            if name.strip() == "main":
+                total = int(cumulative) / 1000
+                break
+            children = [ ]
+    for us, name in sorted(children, reverse=True)[:args.top]:
+        print("{:30} {:8.1f} ms".format(name, us / 1000))
+    print("{:30} {:8.1f} ms  (budget {} ms)".format("main", total, args.budget))
+    if total > args.budget:
+        sys.exit("over the startup budget")
+
+# Time (ms) allowed to render index.html with a 90-day, 20-calendar result
+RENDER_BUDGET_MS = 250
+
+
+def bench_render(args):
+    """Rendering index.html with a large free/busy result."""
+    import flask
+    import main as web
+    app = web.create_app()
+    app.secret_key = "bench"
+
+    # Four one-hour meetings in each 9 to 5 day, the rest of it free.
+    # Each calendar's meetings are shifted by a few minutes, as no two
+    # real calendars have the same busy times.
+    first = datetime.date(2016, 11, 1)
+    hours = working_hours(first, first + datetime.timedelta(days=args.days - 1),
+                          datetime.time(9), datetime.time(17), "US/Pacific")
+    calendars = [ ]
+    for n in range(args.calendars):
+        busy_agenda = Agenda()
+        for window in hours:
+            for hour in (1, 3, 4, 6):
+                meeting = window.begin.replace(hours=+hour, minutes=+5 * (n % 12))
+                busy_agenda.append(Appt(meeting, meeting.replace(hours=+1), ""))
+        calendars.append(("Calendar {}".format(n), busy_agenda))
+
+    def results():
+        """The listings as get_freebusy_times stores them"""
+        busy_times, free_times = [ ], [ ]
+        for name, busy_agenda in calendars:
+            busy_times.append({name: [web.display_interval(appt) for appt
+                                      in busy_agenda.intersect_normalized(hours)]})
+            free_times.append({name: [web.display_interval(appt) for appt
+                                      in hours.difference(busy_agenda)]})
+        return busy_times, free_times
+
+    started = time.perf_counter()
+    busy_times, free_times = results()
+    computed = (time.perf_counter() - started) * 1000
+
+    def render():
+        with app.test_request_context("/index"):
+            flask.session['free_times'] = free_times
+            flask.session['busy_times'] = busy_times
+            return flask.render_template('index.html')
+
+    render()    # template compilation is not part of the budget
+    elapsed = min(timeit.repeat(render, number=1, repeat=args.repeat)) * 1000
+    print("{} calendars over {} days: results in {:.1f} ms, {} bytes rendered "
+          "in {:.1f} ms  (budget {} ms)".format(args.calendars, args.days,
+                                               computed, len(render()),
+                                               elapsed, args.budget))
+    if elapsed > args.budget:
+        sys.exit("over the render budget")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    benchmarks = parser.add_subparsers(dest="benchmark")
+    serialize = benchmarks.add_parser("serialize", help=bench_serialize.__doc__)
+    serialize.add_argument("--appts", type=int, default=5000)
+    serialize.add_argument("--repeat", type=int, default=5)
+    serialize.set_defaults(run=bench_serialize)
+    scaling = benchmarks.add_parser("batch", help=bench_batch.__doc__)
+    scaling.add_argument("--calendars", type=int, default=500)
+    scaling.add_argument("--days", type=int, default=90)
+    scaling.add_argument("--processes", type=int, nargs="+",
+                         default=sorted({1, 2, 4, multiprocessing.cpu_count()}))
+    scaling.set_defaults(run=bench_batch)
+    startup = benchmarks.add_parser("startup", help=bench_startup.__doc__)
+    startup.add_argument("--budget", type=float, default=STARTUP_BUDGET_MS,
+                         help="milliseconds")
+    startup.add_argument("--top", type=int, default=10)
+    startup.set_defaults(run=bench_startup)
+    rendering = benchmarks.add_parser("render", help=bench_render.__doc__)
+    rendering.add_argument("--calendars", type=int, default=20)
+    rendering.add_argument("--days", type=int, default=90)
+    rendering.add_argument("--repeat", type=int, default=3)
+    rendering.add_argument("--budget", type=float, default=RENDER_BUDGET_MS,
+                           help="milliseconds")
+    rendering.set_defaults(run=bench_render)
+    args = parser.parse_args()
+    if "run" not in args:
+        parser.error("choose a benchmark")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
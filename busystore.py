@@ -0,0 +1,262 @@
+""" On-disk store of busy intervals, one file per calendar.
+
+   Each file holds the normalized (sorted, non-overlapping) busy
+   intervals of one calendar as little-endian pairs of int64 epoch
+   seconds behind a small header, followed in the same form by the
+   windows its fetches have covered: within those windows a time that
+   is not busy is free, outside them nothing is known (see covers()).
+   Readers memory-map the files, so
+   every worker process on a host shares the same pages, and answer
+   range queries with a binary search instead of loading the file.
+   Writers replace a file atomically, so readers never see a partial
+   update.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+import arrow
+from agenda import Agenda, Appt
+
+STORE_MAGIC = b"BUSY"
+STORE_VERSION = 2
+STORE_HEADER = struct.Struct("<4sBBHII")  # magic, version, flags, reserved,
+                                          # count, covered windows
+STORE_RECORD = struct.Struct("<qq")       # begin, end
+STORE_END = struct.Struct("<q")
+
+
+class BusyStore:
+    """Busy intervals of many calendars, kept under one directory."""
+
+    def __init__(self, directory):
+        """Open (creating if necessary) the store in directory."""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._maps = { }    # path -> (inode, mmap)
+
+    def path(self, calendar_id):
+        """File holding the intervals of calendar_id.  Calendar ids are
+        e-mail-like strings, so they are hashed into a safe file name."""
+        digest = hashlib.sha1(calendar_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".busy")
+
+    def intervals(self, calendar_id, begin, end):
+        """Iterate over the busy intervals of calendar_id within
+        [begin, end), clipped to that window.
+
+        Arguments:
+           calendar_id: Google calendar id
+           begin, end:  epoch seconds
+        Returns:
+           iterator of (begin, end) epoch-second pairs, in order
+        """
+        data, count, covered = self._open(calendar_id)
+        for i in range(_first_ending_after(data, STORE_HEADER.size, count,
+                                           begin), count):
+            start, stop = STORE_RECORD.unpack_from(
+                data, STORE_HEADER.size + i * STORE_RECORD.size)
+            if start >= end:
+                break
+            yield max(start, begin), min(stop, end)
+
+    def covers(self, calendar_id, begin, end):
+        """Whether fetches of calendar_id have covered all of [begin, end),
+        so that intervals() there are all of its busy times.  Times that
+        were never fetched are not known to be free.
+
+        Arguments:
+           calendar_id: Google calendar id
+           begin, end:  epoch seconds
+        """
+        if begin >= end:
+            return True
+        data, count, covered = self._open(calendar_id)
+        base = STORE_HEADER.size + count * STORE_RECORD.size
+        i = _first_ending_after(data, base, covered, begin)
+        if i == covered:
+            return False
+        # Covered windows are normalized, so [begin, end) is covered
+        # only if it lies within this one window.
+        start, stop = STORE_RECORD.unpack_from(data, base + i * STORE_RECORD.size)
+        return start <= begin and end <= stop
+
+    def agenda(self, calendar_id, begin, end, tz="local", desc=""):
+        """Busy times of calendar_id between two arrow objects, as an
+        (already normalized) Agenda."""
+        result = Agenda()
+        for start, stop in self.intervals(calendar_id, begin.timestamp,
+                                          end.timestamp):
+            result.append(Appt(arrow.get(start).to(tz),
+                               arrow.get(stop).to(tz), desc))
+        return result
+
+    def update(self, calendar_id, intervals, windows):
+        """Record freshly fetched busy intervals for calendar_id.
+
+        The fetch is authoritative for the windows it covered: anything
+        previously stored inside those windows is replaced, anything
+        outside them is kept.
+
+        Arguments:
+           calendar_id: Google calendar id
+           intervals:   iterable of (begin, end) epoch-second pairs
+           windows:     iterable of (begin, end) epoch-second pairs
+                        that were queried
+        """
+        windows = normalize_intervals(windows)
+        fresh = intersect_intervals(normalize_intervals(intervals), windows)
+        path = self.path(calendar_id)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stored, covered = self._read(path)
+            kept = subtract_intervals(stored, windows)
+            self._write(path, normalize_intervals(kept + fresh),
+                        normalize_intervals(covered + windows))
+
+    def close(self):
+        """Release the memory maps held by this store.  No intervals()
+        iterator may be in use (in any thread) when this is called."""
+        for inode, data in self._maps.values():
+            data.close()
+        self._maps = { }
+
+    def _open(self, calendar_id):
+        """Memory map for calendar_id with its interval and covered
+        window counts, reopened whenever a writer has replaced the file.
+
+        A replaced map is only dropped from the cache, not closed:
+        intervals() iterators still reading it (possibly in another
+        thread) keep it alive, and it is released with the last of them.
+        """
+        path = self.path(calendar_id)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return b"", 0, 0
+        cached = self._maps.get(path)
+        if cached is None or cached[0] != inode:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[path] = (inode, data)
+        else:
+            data = cached[1]
+        count, covered = _counts(data, path)
+        return data, count, covered
+
+    def _read(self, path):
+        """The intervals and the covered windows in the file at path,
+        as two lists."""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return [ ], [ ]
+        count, covered = _counts(data, path)
+        records = [STORE_RECORD.unpack_from(data, STORE_HEADER.size +
+                                            i * STORE_RECORD.size)
+                   for i in range(count + covered)]
+        return records[:count], records[count:]
+
+    def _write(self, path, intervals, covered):
+        """Atomically replace the file at path with intervals and the
+        windows they cover."""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, 0, 0,
+                                          len(intervals), len(covered)))
+                for begin, end in intervals + covered:
+                    f.write(STORE_RECORD.pack(begin, end))
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+
+def _counts(data, path):
+    """The interval and covered window counts in the header of a store
+    file.  Files from an earlier version of the store hold nothing we
+    can use (they do not say what they cover), so they read as empty
+    and the next update replaces them."""
+    if data[:4] != STORE_MAGIC:
+        raise ValueError("Not a busy store file: {}".format(path))
+    if data[4:5] != bytes([STORE_VERSION]):
+        return 0, 0
+    if len(data) < STORE_HEADER.size:
+        raise ValueError("Truncated busy store file: {}".format(path))
+    magic, version, flags, reserved, count, covered = \
+        STORE_HEADER.unpack_from(data)
+    if len(data) < STORE_HEADER.size + (count + covered) * STORE_RECORD.size:
+        raise ValueError("Truncated busy store file: {}".format(path))
+    return count, covered
+
+
+def _first_ending_after(data, base, count, time):
+    """Index of the first of the count records at offset base that ends
+    after time (count if none does).  The records are disjoint and
+    sorted, so their ends are sorted too."""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if STORE_END.unpack_from(data, base + mid * STORE_RECORD.size + 8)[0] <= time:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def normalize_intervals(intervals):
+    """Sort (begin, end) pairs and merge the overlapping or touching
+    ones.  Empty intervals are dropped.  Returns a new list."""
+    merged = [ ]
+    for begin, end in sorted(intervals):
+        if begin >= end:
+            continue
+        if merged and begin <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def subtract_intervals(intervals, windows):
+    """The parts of intervals lying outside every window.  Both
+    arguments must be normalized; so is the result."""
+    result = [ ]
+    i = 0
+    for begin, end in intervals:
+        while i < len(windows) and windows[i][1] <= begin:
+            i += 1
+        j = i
+        while begin < end and j < len(windows) and windows[j][0] < end:
+            wbegin, wend = windows[j]
+            if begin < wbegin:
+                result.append((begin, wbegin))
+            begin = max(begin, wend)
+            j += 1
+        if begin < end:
+            result.append((begin, end))
+    return result
+
+
+def intersect_intervals(first, second):
+    """The times covered by both lists of intervals.  Both arguments
+    must be normalized; so is the result."""
+    result = [ ]
+    i = j = 0
+    while i < len(first) and j < len(second):
+        begin = max(first[i][0], second[j][0])
+        end = min(first[i][1], second[j][1])
+        if begin < end:
+            result.append((begin, end))
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
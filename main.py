@@ -4,6 +4,7 @@ from flask import request
 from flask import url_for
 from flask import jsonify # For AJAX transactions
 import uuid
+import functools
 
 import json
 import logging
@@ -11,18 +12,16 @@ import logging
 # Date handling 
 import arrow # Replacement for datetime, based on moment.js
 import datetime # But we still need time
-from dateutil import tz  # For interpreting local times
 
-
-# OAuth2  - Google library implementation for convenience
-from oauth2client import client
-import httplib2   # used in oauth2 flow
-
-# Google API for services 
-from apiclient import discovery
+# The Google client stack (oauth2client, httplib2, apiclient) is slow
+# to import and only some routes need it, so it is imported in the
+# functions that use it, on first use.  Likewise dateutil's tz in setrange.
 
 # Module to handle busy/free time scheduling
 from agenda import *
+from busystore import BusyStore
+from prefetch import TTLCache, Prefetcher
+from scheduler import CallScheduler, INTERACTIVE, BACKGROUND
 
 # Favicon rendering
 import os
@@ -31,11 +30,33 @@ import os
 # Globals
 ###
 import CONFIG
-app = flask.Flask(__name__)
+
+# Routes and template filters; create_app registers them on an app
+pages = flask.Blueprint('pages', __name__)
 
 SCOPES = 'https://www.googleapis.com/auth/calendar.readonly'
 CLIENT_SECRET_FILE = CONFIG.GOOGLE_LICENSE_KEY  ## You'll need this
 APPLICATION_NAME = 'MeetMe class project'
+FREEBUSY_MAX_ITEMS = 50    # Calendars per freebusy query allowed by Google
+
+# Optional on-disk store of fetched busy intervals, shared by all the
+# worker processes on this host (see busystore.py)
+BUSY_STORE_DIR = getattr(CONFIG, 'BUSY_STORE_DIR', None)
+busy_store = BusyStore(BUSY_STORE_DIR) if BUSY_STORE_DIR else None
+
+# Server-side caches of calendar lists and busy times, keyed by the
+# session's 'sid'.  Background jobs fill them as soon as we know what a
+# session will ask for (see start_prefetch).
+CACHE_TTL = getattr(CONFIG, 'CACHE_TTL', 300)
+calendar_cache = TTLCache(maxsize=1024, ttl=CACHE_TTL)
+busy_cache = TTLCache(maxsize=16384, ttl=CACHE_TTL)
+prefetcher = Prefetcher(max_jobs=getattr(CONFIG, 'PREFETCH_JOBS', 4))
+
+# Every Google API call goes through the scheduler, which collapses
+# identical concurrent calls and keeps us within our request quota
+# (see scheduler.py)
+gcal_scheduler = CallScheduler(rate=getattr(CONFIG, 'GCAL_RATE', 10),
+                               burst=getattr(CONFIG, 'GCAL_BURST', 20))
 
 #############################
 #
@@ -43,27 +64,27 @@ APPLICATION_NAME = 'MeetMe class project'
 #
 #############################
 
-@app.route("/")
-@app.route("/index")
+@pages.route("/")
+@pages.route("/index")
 def index():
-  app.logger.debug("Entering index")
+  flask.current_app.logger.debug("Entering index")
   return render_template('index.html')
 
-@app.route("/choose")
+@pages.route("/choose")
 def choose():
     ## We'll need authorization to list calendars 
     ## I wanted to put what follows into a function, but had
     ## to pull it back here because the redirect has to be a
     ## 'return' 
-    app.logger.debug("Checking credentials for Google calendar access")
+    flask.current_app.logger.debug("Checking credentials for Google calendar access")
     credentials = valid_credentials()
     if not credentials:
-      app.logger.debug("Redirecting to authorization")
-      return flask.redirect(flask.url_for('oauth2callback'))
+      flask.current_app.logger.debug("Redirecting to authorization")
+      return flask.redirect(flask.url_for('.oauth2callback'))
 
     gcal_service = get_gcal_service(credentials)
-    app.logger.debug("Returned from get_gcal_service")
-    flask.session['calendars'] = list_calendars(gcal_service)
+    flask.current_app.logger.debug("Returned from get_gcal_service")
+    flask.session['calendars'] = cached_calendars(gcal_service, session_id())
     return render_template('index.html')
 
 #############################
@@ -71,7 +92,7 @@ def choose():
 #  AJAX request handler
 #
 #############################
-@app.route("/_setbusytimes")
+@pages.route("/_setbusytimes")
 def find_busy():
 	'''
 	Receive AJAX request to find the busy times 
@@ -81,11 +102,65 @@ def find_busy():
 	credentials = valid_credentials()
 	gcal_service = get_gcal_service(credentials)
 	
-	busy_times, free_times = get_freebusy_times(gcal_service, indices)	
+	try:
+		busy_times, free_times = get_freebusy_times(gcal_service, indices)
+	except FreeBusyError as error:
+		flask.current_app.logger.warning(str(error))
+		return jsonify(error="Could not get the busy times of every calendar"), 502
 	flask.session['busy_times'] = busy_times	
 	flask.session['free_times'] = free_times
 	
 	return jsonify(result={})
+
+@pages.route("/_heatmap")
+def heatmap():
+	'''
+	Receive AJAX request for group availability: how many of the selected
+	calendars are free in each slot of the chosen range, and the periods
+	within the daily time windows where at least 'least' of them are free.
+	'''
+	indices = request.args.get("indices", "", type=str)
+	minutes = request.args.get("minutes", 30, type=int)
+	least = request.args.get("least", len(indices), type=int)
+	if not indices:
+		return jsonify(error="no calendars selected"), 400
+	if minutes <= 0:
+		return jsonify(error="minutes must be positive"), 400
+	if not 1 <= least <= len(indices):
+		return jsonify(error="least must be between 1 and the number of calendars"), 400
+	
+	credentials = valid_credentials()
+	gcal_service = get_gcal_service(credentials)
+	
+	calendar_ids = [flask.session['calendars'][int(index)]['id'] for index in indices]
+	hours = session_working_hours()
+	timeMin = hours.appts[0].begin.isoformat()
+	timeMax = hours.appts[-1].end.isoformat()
+	try:
+		busy = cached_busy(gcal_service, session_id(), calendar_ids, timeMin, timeMax)
+	except FreeBusyError as error:
+		flask.current_app.logger.warning(str(error))
+		return jsonify(error="Could not get the busy times of every calendar"), 502
+	
+	agendas = []
+	for id in calendar_ids:
+		agenda = Agenda()
+		for start, end in busy[id]:
+			agenda.append(Appt(arrow.get(start), arrow.get(end), ""))
+		agendas.append(agenda)
+	
+	begin = hours.appts[0].begin
+	end = hours.appts[-1].end
+	counts = free_count_grid(agendas, begin, end, minutes)
+	slots = free_slots(counts, least, begin, end, minutes).intersect_normalized(hours)
+	
+	return jsonify(result={
+		"begin": timeMin,
+		"minutes": minutes,
+		"calendars": len(calendar_ids),
+		"counts": counts,
+		"free": [appt.get_isoformat() for appt in slots]
+	})
 	
 	
 def get_freebusy_times(gcal_service, calendar_indices):
@@ -104,99 +179,202 @@ def get_freebusy_times(gcal_service, calendar_indices):
 								lists of the form
 								[ 
 								  {"cal1" : [
-												[time_start,time_end],
+												[time_start,time_end,
+												 start_text,end_text],
 											 	[...]
 											]
 								   }, 
 								  {"cal2" : ...} 
 								]
+								where the texts are the times as displayed
+								(see display_interval)
 	'''
 	busy_times = []
 	free_times = []
+	hours = session_working_hours()
+	calendars = [flask.session['calendars'][int(index)] for index in calendar_indices]
 	
-	start_date, end_date = flask.session['daterange'].split(" - ")
-	time_range_start = arrow.get(start_date + flask.session['begin_time'], "MM/DD/YYYYHH:mm:ssZZ")
-	time_range_end = arrow.get(start_date + flask.session['end_time'], "MM/DD/YYYYHH:mm:ssZZ")
-	end_date = arrow.get(end_date, "MM/DD/YYYY")
-
-	app.logger.debug("Sending freebusy requests to Google Cal")
-	for index in calendar_indices:
-		calendar = flask.session['calendars'][int(index)]
+	flask.current_app.logger.debug("Sending freebusy requests to Google Cal")
+	fetched = cached_busy(gcal_service, session_id(), [cal['id'] for cal in calendars],
+		hours.appts[0].begin.isoformat(), hours.appts[-1].end.isoformat())
+	
+	for calendar in calendars:
 		calendar_name = calendar['summary']
 		
-		busy = {calendar_name : []}
-		free = {calendar_name : []}
-		timeMin = time_range_start.isoformat()
-		timeMax = time_range_end.isoformat()
+		busy_agenda = Agenda()
+		for start, end in fetched[calendar['id']]:
+			busy_agenda.append(Appt(arrow.get(start), arrow.get(end), ""))
+		busy_agenda.normalize()
 		
-		for day in arrow.Arrow.span_range('day', time_range_start, end_date):		
-			query = {
-				"timeMin": timeMin,
-				"timeMax": timeMax,
-				"items": [
-					{
-						"id": calendar['id']
-					}
-				]
-			}
-			
-			gcal_request = gcal_service.freebusy().query(body=query)	
-			result = gcal_request.execute()
-			
-			for busy_time in result['calendars'][calendar['id']]['busy']:
-			    start = arrow.get(busy_time['start']).to('local')
-			    end = arrow.get(busy_time['end']).to('local')
-			    conflict = [start.isoformat(), end.isoformat()]
-			    busy[calendar_name].append(conflict)
-			# Using the busy times, determine the free times
-			free_time = determine_free_times(busy[calendar_name], timeMin, timeMax)
-			free[calendar_name].extend(free_time)
-			
-			timeMin = next_day(timeMin)
-			timeMax = next_day(timeMax)
+		# Busy times within the working hours, and the rest of them free
+		busy = {calendar_name : [display_interval(appt)
+			for appt in busy_agenda.intersect_normalized(hours)]}
+		free = {calendar_name : [display_interval(appt)
+			for appt in hours.difference(busy_agenda)]}
 		
 		free_times.append(free)
 		busy_times.append(busy)		
 		
 	return busy_times, free_times
+
+def session_working_hours():
+	'''
+	The daily time windows of the date and time range chosen in /setrange,
+	in local time (see agenda.working_hours; memoized per range and hours).
 	
-def determine_free_times(busy_times, free_start, free_end):
-	''' Given a list of busy times, and a free block (a beginning and ending free time),
-	determines the free times. In other words, finds the complement of the busy_times.
+	Returns:
+		A normalized Agenda with one appointment per day
+	'''
+	start_date, end_date = flask.session['daterange'].split(" - ")
+	first_day = datetime.datetime.strptime(start_date, "%m/%d/%Y").date()
+	last_day = datetime.datetime.strptime(end_date, "%m/%d/%Y").date()
+	# begin_time and end_time are "HH:mm:ss" plus the UTC offset when the
+	# range was chosen; the wall-clock hours are what apply on every day
+	begin = datetime.datetime.strptime(flask.session['begin_time'][:5], "%H:%M").time()
+	end = datetime.datetime.strptime(flask.session['end_time'][:5], "%H:%M").time()
+	return working_hours(first_day, last_day, begin, end, 'local')
+
+class FreeBusyError(Exception):
+	'''
+	Google could not give us the busy times of some calendar.
+	'''
+
+def query_busy(gcal_service, calendar_ids, timeMin, timeMax, priority=INTERACTIVE):
+	'''
+	Asks the Google Calendar API for the busy times of several calendars
+	at once, FREEBUSY_MAX_ITEMS calendars per freebusy request.  Identical
+	requests in flight from other sessions are shared: calendar ids only
+	come from the user's own calendar list, so they may see the result.
 	
 	Args:
-		busy_times: 		A list of busy times in the form [
-															 	[start, end],
-															 	[...]
-															 ]
-		free_start: 		A string representing the isoformat of the start time of the
-							free block.
-		free_end:			A string representing the isoformat of the end time of the
-							free block.
-							
+		gcal_service: 		Google Calendar Service Object
+		calendar_ids: 		List of calendar ids
+		timeMin, timeMax: 	Isoformat strings bounding the query
+		priority: 			INTERACTIVE or BACKGROUND (prefetch)
 	Returns:
-		free_times:			A list of free times the form [
-																[start, end],
-																[...]
-														  ]
+		A dict from calendar id to a list of busy times of the form 
+		[ [start, end], [...] ], in local time
+	Raises:
+		FreeBusyError if Google reports errors for (or leaves out) any
+		of the calendars, rather than passing them off as free
 	'''
-	# app.logger.debug("Determining free times")
-	busy_agenda = Agenda()
-	for busy_time in busy_times:
-		start, end = busy_time
-		start = arrow.get(start)
-		end = arrow.get(end)
-		busy_agenda.append(Appt(start, end, ""))
-	
-	busy_agenda.normalize()
-	free_start = arrow.get(free_start)
-	free_end = arrow.get(free_end)
-	free_block = Appt(free_start, free_end, "")
-	free_agenda = busy_agenda.complement(free_block)
-	
-	free_times = [appt.get_isoformat() for appt in free_agenda]
-	
-	return free_times		
+	busy = {}
+	for i in range(0, len(calendar_ids), FREEBUSY_MAX_ITEMS):
+		query = {
+			"timeMin": timeMin,
+			"timeMax": timeMax,
+			"items": [{"id": id} for id in calendar_ids[i:i + FREEBUSY_MAX_ITEMS]]
+		}
+		key = ('freebusy', tuple(calendar_ids[i:i + FREEBUSY_MAX_ITEMS]), timeMin, timeMax)
+		# The call made (not ones collapsed into it) records its result
+		def fetch(query=query):
+			result = gcal_service.freebusy().query(body=query).execute()
+			if busy_store is not None:
+				store_busy(result, timeMin, timeMax)
+			return result
+		result = gcal_scheduler.call(key, fetch, priority)
+		failed = {}
+		for id in calendar_ids[i:i + FREEBUSY_MAX_ITEMS]:
+			calendar = result['calendars'].get(id)
+			if calendar is None or calendar.get('errors'):
+				failed[id] = calendar['errors'] if calendar else "missing from response"
+		if failed:
+			raise FreeBusyError("Freebusy query failed for {}".format(failed))
+		for id, calendar in result['calendars'].items():
+			busy[id] = [[arrow.get(busy_time['start']).to('local').isoformat(),
+						 arrow.get(busy_time['end']).to('local').isoformat()]
+						for busy_time in calendar.get('busy', [])]
+	return busy
+
+def store_busy(result, timeMin, timeMax):
+	'''
+	Records the busy times of a freebusy result in busy_store, as all
+	of them between timeMin and timeMax.  Calendars Google reports
+	errors for are left out.  The store only saves later fetches, so
+	failing to write it is logged rather than failing the request.
+	'''
+	window = [(arrow.get(timeMin).timestamp, arrow.get(timeMax).timestamp)]
+	for id, calendar in result['calendars'].items():
+		if calendar.get('errors'):
+			continue
+		try:
+			busy_store.update(id,
+				[(arrow.get(busy_time['start']).timestamp, arrow.get(busy_time['end']).timestamp)
+				 for busy_time in calendar.get('busy', [])], window)
+		except (OSError, ValueError):
+			flask.current_app.logger.exception(
+				"Could not store the busy times of {}".format(id))
+
+def cached_busy(gcal_service, sid, calendar_ids, timeMin, timeMax, priority=INTERACTIVE):
+	'''
+	query_busy, answered from busy_cache where possible; the calendars
+	that miss are fetched together and cached for session sid.  Those
+	already being fetched for the session (say by its prefetch) are
+	waited for rather than fetched again.
+	'''
+	def load(keys):
+		fetched = query_busy(gcal_service, [key[1] for key in keys], timeMin, timeMax, priority)
+		return {key: fetched[key[1]] for key in keys}
+	busy = busy_cache.fetch([(sid, id, timeMin, timeMax) for id in calendar_ids], load)
+	return {key[1]: value for key, value in busy.items()}
+
+def cached_calendars(gcal_service, sid, priority=INTERACTIVE):
+	'''
+	list_calendars, answered from calendar_cache where possible.
+	'''
+	calendars = calendar_cache.get(sid)
+	if calendars is None:
+		calendars = gcal_scheduler.call(('calendarList', sid),
+			lambda: list_calendars(gcal_service), priority)
+		calendar_cache.put(sid, calendars)
+	return calendars
+
+def session_id():
+	'''
+	Key of this session's entries in the server-side caches.
+	'''
+	if 'sid' not in flask.session:
+		flask.session['sid'] = str(uuid.uuid4())
+	return flask.session['sid']
+
+def start_prefetch():
+	'''
+	Start warming the caches with what this session will ask for next:
+	its calendar list and, once a range is chosen, the busy times of its
+	primary and selected calendars over that range.  Replaces (cancels)
+	the session's previous prefetch job.
+	'''
+	if 'credentials' not in flask.session:
+		return
+	timeMin = timeMax = None
+	if 'daterange' in flask.session:
+		hours = session_working_hours()
+		timeMin = hours.appts[0].begin.isoformat()
+		timeMax = hours.appts[-1].end.isoformat()
+	prefetcher.submit(session_id(), prefetch, flask.current_app._get_current_object(),
+		flask.session['credentials'], session_id(), flask.session.get('calendars'),
+		timeMin, timeMax)
+
+def prefetch(cancelled, app, credentials_json, sid, calendars, timeMin, timeMax):
+	'''
+	Background job started by start_prefetch, run in an app context of
+	'app'.  Stops early once 'cancelled' (a threading.Event) is set.
+	'''
+	from oauth2client import client
+	with app.app_context():
+		try:
+			credentials = client.OAuth2Credentials.from_json(credentials_json)
+			gcal_service = get_gcal_service(credentials)
+			if calendars is None:
+				if cancelled.is_set():
+					return
+				calendars = cached_calendars(gcal_service, sid, BACKGROUND)
+			if timeMin is None or cancelled.is_set():
+				return
+			calendar_ids = [cal['id'] for cal in calendars if cal['primary'] or cal['selected']]
+			cached_busy(gcal_service, sid, calendar_ids, timeMin, timeMax, BACKGROUND)
+		except Exception:
+			app.logger.exception("Prefetch failed")
 	
 ####
 #
@@ -237,6 +415,7 @@ def valid_credentials():
     if 'credentials' not in flask.session:
       return None
 
+    from oauth2client import client
     credentials = client.OAuth2Credentials.from_json(flask.session['credentials'])
 
     if (credentials.invalid or credentials.access_token_expired):
@@ -254,13 +433,15 @@ def get_gcal_service(credentials):
   end up redirected back to /choose *without a service object*.
   Then the second call will succeed without additional authorization.
   """
-  app.logger.debug("Entering get_gcal_service")
+  flask.current_app.logger.debug("Entering get_gcal_service")
+  import httplib2   # used in oauth2 flow
+  from apiclient import discovery   # Google API for services
   http_auth = credentials.authorize(httplib2.Http())
   service = discovery.build('calendar', 'v3', http=http_auth)
-  app.logger.debug("Returning service")
+  flask.current_app.logger.debug("Returning service")
   return service
 
-@app.route('/oauth2callback')
+@pages.route('/oauth2callback')
 def oauth2callback():
   """
   The 'flow' has this one place to call back to.  We'll enter here
@@ -269,11 +450,13 @@ def oauth2callback():
   step, the second time we'll skip the first step and do the second,
   and so on.
   """
-  app.logger.debug("Entering oauth2callback")
+  flask.current_app.logger.debug("Entering oauth2callback")
+  # OAuth2  - Google library implementation for convenience
+  from oauth2client import client
   flow =  client.flow_from_clientsecrets(
       CLIENT_SECRET_FILE,
       scope= SCOPES,
-      redirect_uri=flask.url_for('oauth2callback', _external=True))
+      redirect_uri=flask.url_for('.oauth2callback', _external=True))
   ## Note we are *not* redirecting above.  We are noting *where*
   ## we will redirect to, which is this function. 
   
@@ -281,9 +464,9 @@ def oauth2callback():
   ## with 'code' set in the URL parameter.  If we don't
   ## see that, it must be the first time through, so we
   ## need to do step 1. 
-  app.logger.debug("Got flow")
+  flask.current_app.logger.debug("Got flow")
   if 'code' not in flask.request.args:
-    app.logger.debug("Code not in flask.request.args")
+    flask.current_app.logger.debug("Code not in flask.request.args")
     auth_uri = flow.step1_get_authorize_url()
     return flask.redirect(auth_uri)
     ## This will redirect back here, but the second time through
@@ -291,15 +474,18 @@ def oauth2callback():
   else:
     ## It's the second time through ... we can tell because
     ## we got the 'code' argument in the URL.
-    app.logger.debug("Code was in flask.request.args")
+    flask.current_app.logger.debug("Code was in flask.request.args")
     auth_code = flask.request.args.get('code')
     credentials = flow.step2_exchange(auth_code)
     flask.session['credentials'] = credentials.to_json()
+    # A new login starts with fresh server-side cache entries
+    flask.session['sid'] = str(uuid.uuid4())
+    start_prefetch()
     ## Now I can build the service and execute the query,
     ## but for the moment I'll just log it and go back to
     ## the main screen
-    app.logger.debug("Got credentials")
-    return flask.redirect(flask.url_for('choose'))
+    flask.current_app.logger.debug("Got credentials")
+    return flask.redirect(flask.url_for('.choose'))
 
 #####
 #
@@ -312,34 +498,35 @@ def oauth2callback():
 #
 #####
 
-@app.route('/setrange', methods=['POST'])
+@pages.route('/setrange', methods=['POST'])
 def setrange():
     """
     User chose a date range with the bootstrap daterange widget.
     """
-    app.logger.debug("Entering setrange")  
+    flask.current_app.logger.debug("Entering setrange")  
     daterange = request.form.get('daterange')
     begintime = request.form.get('begintime')
     endtime = request.form.get('endtime')
     ## flask.flash("Setrange gave us '{}', '{}', '{}'".format(daterange, begintime, endtime))
+    from dateutil import tz  # For interpreting local times
+    
+    begin = arrow.get(begintime, "HH:mm")
+    end = arrow.get(endtime, "HH:mm")
+    if end <= begin:
+        flask.flash("The end time must be after the begin time")
+        return flask.redirect(flask.url_for(".index"))
     
-    bt = arrow.get(begintime, "HH:mm").replace(tzinfo=tz.tzlocal()).isoformat().split("T")[1]
-    et = arrow.get(endtime, "HH:mm").replace(tzinfo=tz.tzlocal()).isoformat().split("T")[1]
+    bt = begin.replace(tzinfo=tz.tzlocal()).isoformat().split("T")[1]
+    et = end.replace(tzinfo=tz.tzlocal()).isoformat().split("T")[1]
     
     flask.session['daterange'] = daterange
     flask.session['begin_time'] = bt
     flask.session['end_time'] = et
+    start_prefetch()
     
-    return flask.redirect(flask.url_for("choose"))
+    return flask.redirect(flask.url_for(".choose"))
 
 
-def next_day(isotext):
-    """
-    ISO date + 1 day (used in query to Google calendar)
-    """
-    as_arrow = arrow.get(isotext)
-    return as_arrow.replace(days=+1).isoformat()
-
 ####
 #
 #  Functions (NOT pages) that return some information
@@ -355,7 +542,7 @@ def list_calendars(service):
     the primary calendar first, and selected (that is, displayed in
     Google Calendars web app) calendars before unselected calendars.
     """
-    app.logger.debug("Entering list_calendars")  
+    flask.current_app.logger.debug("Entering list_calendars")  
     calendar_list = service.calendarList().list().execute()["items"]
     result = [ ]
     for cal in calendar_list:
@@ -403,9 +590,9 @@ def cal_sort_key( cal ):
 #
 #################
   
-@app.route('/favicon.ico')
+@pages.route('/favicon.ico')
 def favicon():
-    return flask.send_from_directory(os.path.join(app.root_path, 'static'),
+    return flask.send_from_directory(os.path.join(flask.current_app.root_path, 'static'),
                                'favicon.ico', mimetype='image/vnd.microsoft.icon')
 
 #################
@@ -414,39 +601,92 @@ def favicon():
 #
 #################
 
-@app.template_filter( 'fmtdate' )
+# Display formats.  The free/busy listings are formatted once, when the
+# results are computed (display_interval), so a render only prints them;
+# the filters handle the few other timestamps on a page and keep a small
+# memo keyed by the raw text.
+DATETIME_DISPLAY = "MM/DD/YYYY hh:mm A"
+TIME_DISPLAY = "hh:mm A"
+FORMAT_CACHE_SIZE = 256
+FORMAT_ERRORS = (arrow.parser.ParserError, ValueError, TypeError)
+
+def display_interval( appt ):
+    """
+    An Appt as stored in the session for the listings:
+    [begin isoformat, end isoformat, begin as displayed, end as displayed]
+    """
+    return appt.get_isoformat() + [ appt.begin.format( DATETIME_DISPLAY ),
+                                    appt.end.format( TIME_DISPLAY ) ]
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def format_timestamp( text, display, parse=None ):
+    """
+    Parse a raw timestamp (optionally with an explicit arrow parse format)
+    and render it in the given display format.  Memoized; raises one of
+    FORMAT_ERRORS for text that cannot be parsed.
+    """
+    if text is None:
+        # arrow.get(None) is "now", which must not be memoized
+        raise ValueError("No timestamp")
+    if parse is None:
+        normal = arrow.get( text )
+    else:
+        normal = arrow.get( text, parse )
+    return normal.format( display )
+
+@pages.app_template_filter( 'fmtdate' )
 def format_arrow_date( date ):
     try: 
-        normal = arrow.get( date )
-        return normal.format("ddd MM/DD/YYYY")
-    except:
+        return format_timestamp( date, "ddd MM/DD/YYYY" )
+    except FORMAT_ERRORS:
         return "(bad date)"
         
-@app.template_filter( 'fmttime' )
+@pages.app_template_filter( 'fmttime' )
 def format_arrow_time( time ):
     try:
-        normal = arrow.get(time, "HH:mm:ssZZ")
-        return normal.format("hh:mm A")
-    except:
+        return format_timestamp( time, TIME_DISPLAY, "HH:mm:ssZZ" )
+    except FORMAT_ERRORS:
         return "(bad time)"
 
         
-@app.template_filter( 'fmtdatetime' )
+@pages.app_template_filter( 'fmtdatetime' )
 def format_arrow_datetime( datetime ):
     try:
-        normal = arrow.get(datetime)
-        return normal.format("MM/DD/YYYY hh:mm A")
-    except:
+        return format_timestamp( datetime, DATETIME_DISPLAY )
+    except FORMAT_ERRORS:
         return "(bad time)"
     
 #############
+#
+# Application factory
+#
+#############
 
+def create_app():
+    """
+    Build the Flask app.  Importing this module stays cheap: nothing
+    here loads the Google client stack, which is imported by the
+    routes that need it on first use.
+    """
+    app = flask.Flask(__name__)
+    app.register_blueprint(pages)
+    return app
 
-if __name__ == "__main__":
-  # App is created above so that it will
-  # exist whether this is 'main' or not
-  # (e.g., if we are running in a CGI script)
 
+def __getattr__(name):
+    """
+    'main.app' for servers and scripts that import it, built on first
+    access rather than at import time.
+    """
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+if __name__ == "__main__":
+  app = create_app()
   app.secret_key = str(uuid.uuid4())  
   app.debug=CONFIG.DEBUG
   app.logger.setLevel(logging.DEBUG)
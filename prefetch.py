@@ -0,0 +1,166 @@
+""" Server-side caches and background prefetching.
+
+   As soon as we know what a user is going to ask for (after login,
+   after choosing a date range) we start fetching it in the background
+   into a TTLCache, so that the request that actually needs the data
+   mostly finds it there.  A Prefetcher runs a bounded number of such
+   jobs at once, and a new job for the same owner (e.g. the same
+   session choosing a different range) cancels the old one.
+"""
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+
+class TTLCache:
+    """A thread-safe mapping whose entries expire after 'ttl' seconds,
+    holding at most 'maxsize' entries (least recently used go first).
+    Values can also be loaded through the cache (fetch), so that a
+    caller needing a key some other caller is loading waits for it
+    instead of loading it again.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()   # key -> (expires, value)
+        self._loading = { }     # key -> Future of the load in flight
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """The cached value for key, or default if absent or expired."""
+        with self._lock:
+            return self._get(key, default)
+
+    def fetch(self, keys, load):
+        """The values for keys, from the cache where possible.
+
+        The keys neither cached nor being loaded are loaded together
+        with load(missing keys), which returns a dict holding a value
+        for each of them, and cached.  Keys another fetch is loading
+        are waited for; if that load fails, they are loaded here.
+
+        Returns:
+           dict of key to value
+        Raises:
+           whatever load raises
+        """
+        values = { }
+        waiting = { }   # key -> Future of another caller's load
+        missing = [ ]
+        loading = concurrent.futures.Future()
+        with self._lock:
+            for key in keys:
+                value = self._get(key, _ABSENT)
+                if value is not _ABSENT:
+                    values[key] = value
+                elif key in self._loading:
+                    waiting[key] = self._loading[key]
+                else:
+                    self._loading[key] = loading
+                    missing.append(key)
+        if missing:
+            try:
+                loaded = load(missing)
+                for key in missing:
+                    values[key] = loaded[key]
+                    self.put(key, loaded[key])
+            except BaseException as error:
+                loading.set_exception(error)
+                raise
+            else:
+                loading.set_result(loaded)
+            finally:
+                with self._lock:
+                    for key in missing:
+                        del self._loading[key]
+        failed = [ ]
+        for key, future in waiting.items():
+            try:
+                values[key] = future.result()[key]
+            except Exception:
+                failed.append(key)
+        if failed:
+            values.update(self.fetch(failed, load))
+        return values
+
+    def put(self, key, value):
+        """Cache value under key, evicting the oldest entry if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, default):
+        """get(), with the lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return entry[1]
+
+
+_ABSENT = object()    # a cache miss, as None may be a cached value
+
+
+class Prefetcher:
+    """Runs background jobs on at most 'max_jobs' threads.
+
+    Each job belongs to an owner (for us, a session).  Submitting a job
+    cancels the owner's previous one: if it has not started it never
+    will, and if it is running, the threading.Event it was given is set
+    so it can stop at its next check.  Jobs are best effort; while
+    'max_pending' jobs are queued or running, new ones are dropped.
+    """
+
+    def __init__(self, max_jobs=4, max_pending=64):
+        self.max_pending = max_pending
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_jobs)
+        self._jobs = { }    # owner -> (future, cancelled event)
+        self._lock = threading.RLock()
+
+    def submit(self, owner, job, *args):
+        """Run job(cancelled, *args) in the background for owner.
+
+        Returns:
+           The job's Future, or None if it was dropped
+        """
+        with self._lock:
+            self.cancel(owner)
+            pending = sum(1 for future, cancelled in self._jobs.values()
+                          if not future.done())
+            if pending >= self.max_pending:
+                return None
+            cancelled = threading.Event()
+            future = self._executor.submit(job, cancelled, *args)
+            self._jobs[owner] = (future, cancelled)
+            future.add_done_callback(
+                lambda done: self._finished(owner, done))
+            return future
+
+    def cancel(self, owner):
+        """Cancel owner's job, if any."""
+        with self._lock:
+            future, cancelled = self._jobs.pop(owner, (None, None))
+            if future is not None:
+                cancelled.set()
+                future.cancel()
+
+    def shutdown(self):
+        """Stop accepting jobs and wait for the running ones."""
+        self._executor.shutdown(wait=True)
+
+    def _finished(self, owner, future):
+        """Forget owner's job once it is done (unless replaced)."""
+        with self._lock:
+            if self._jobs.get(owner, (None,))[0] is future:
+                del self._jobs[owner]
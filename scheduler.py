@@ -0,0 +1,103 @@
+""" Scheduling of calls to a rate-limited API (for us, Google Calendar).
+
+   A CallScheduler sits in front of every upstream call:
+
+   - Identical calls in flight at the same time are collapsed: the
+     first caller makes the call and every caller with the same key
+     gets its result (or its exception).
+   - Calls are admitted through a token bucket, 'rate' calls per
+     second with bursts of up to 'burst', so that all sessions in a
+     process share one budget.
+   - Interactive calls go before background (prefetch, batch) calls
+     whenever both are waiting for a token.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class CallScheduler:
+    """Collapses identical concurrent calls and rate-limits the rest."""
+
+    def __init__(self, rate=10.0, burst=20):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._inflight = { }    # key -> _Call
+        self._waiting = [ ]     # _Calls waiting for a token
+        self._cond = threading.Condition()
+
+    def call(self, key, fn, priority=INTERACTIVE):
+        """Return fn(), or the result of an identical call already in
+        flight.
+
+        Arguments:
+           key:  hashable; calls with equal keys must be interchangeable
+           fn:   function of no arguments making the upstream call
+           priority: INTERACTIVE or BACKGROUND
+        Raises:
+           whatever fn raises
+        """
+        with self._cond:
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = _Call(priority)
+                self._inflight[key] = pending
+                leader = True
+            else:
+                leader = False
+                if priority < pending.priority:
+                    # An interactive caller is now waiting on this call
+                    pending.priority = priority
+                    self._cond.notify_all()
+        if not leader:
+            return pending.future.result()
+
+        try:
+            self._acquire(pending)
+            result = fn()
+        except BaseException as error:
+            pending.future.set_exception(error)
+            raise
+        else:
+            pending.future.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                del self._inflight[key]
+
+    def _acquire(self, pending):
+        """Wait for a token, letting higher-priority calls go first."""
+        with self._cond:
+            self._waiting.append(pending)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens +
+                                       (now - self._stamp) * self.rate)
+                    self._stamp = now
+                    ahead = any(other.priority < pending.priority
+                                for other in self._waiting)
+                    if self._tokens >= 1 and not ahead:
+                        self._tokens -= 1
+                        return
+                    if self._tokens >= 1:
+                        self._cond.wait()
+                    else:
+                        self._cond.wait((1 - self._tokens) / self.rate)
+            finally:
+                self._waiting.remove(pending)
+                self._cond.notify_all()
+
+
+class _Call:
+    """An upstream call in flight and the priority it runs at."""
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.future = concurrent.futures.Future()
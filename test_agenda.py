@@ -3,6 +3,7 @@ Nose test suite for agenda.py
 """
 
 import arrow
+import datetime
 from agenda import *
 
 a = arrow.get("01/01/2014 17:00","MM/DD/YYYY HH:mm")
@@ -91,6 +92,8 @@ def test_agenda():
 	solution = Agenda()
 	solution.append(Appt(w, d, "Test"))
 	assert intersection == solution
+	assert schedule1.intersect_normalized(schedule2) == solution
+	assert schedule2.intersect_normalized(schedule1) == solution
 	
 	y = arrow.get("01/01/2014 09:00","MM/DD/YYYY HH:mm")
 	z = arrow.get("01/01/2014 22:00","MM/DD/YYYY HH:mm")
@@ -103,4 +106,95 @@ def test_agenda():
 	
 	complement = schedule1.complement(free)
 	assert complement == solution
-	
\ No newline at end of file
+	
+def test_agenda_pack():
+	'''
+	Testing Agenda.dumps / Agenda.loads round trip
+	'''
+	schedule = Agenda()
+	schedule.append(app1)
+	schedule.append(app3)
+	
+	packed = schedule.dumps()
+	assert Agenda.loads(packed) == schedule
+	assert list(iter_packed(bytearray(packed))) == [
+		(a.timestamp, b.timestamp), (e.timestamp, f.timestamp)]
+	
+	assert len(Agenda.loads(Agenda().dumps())) == 0
+	
+	try:
+		Agenda.loads(packed[:-1])
+		assert False
+	except ValueError:
+		pass
+
+def test_free_count_grid():
+	'''
+	Testing free_count_grid and free_slots
+	'''
+	schedule1 = Agenda()
+	schedule1.append(app1)
+	schedule1.append(app2)
+	schedule2 = Agenda()
+	schedule2.append(app3)
+	
+	# 17:00 - 22:00 in hour slots; app2 ends 18:45, app3 is 20:00 - 21:30
+	counts = free_count_grid([schedule1, schedule2, Agenda()], a, 
+		a.replace(hours=+5), minutes=60)
+	assert counts == [2, 2, 3, 2, 2]
+	
+	slots = free_slots(counts, 3, a, a.replace(hours=+5), minutes=60)
+	solution = Agenda()
+	solution.append(Appt(arrow.get("01/01/2014 19:00","MM/DD/YYYY HH:mm"), e, ""))
+	assert slots == solution
+	assert len(free_slots(counts, 2, a, a.replace(hours=+5), minutes=60)) == 1
+
+def test_agenda_difference():
+	'''
+	Testing Agenda.difference
+	'''
+	day = Agenda()
+	day.append(Appt(arrow.get("01/01/2014 09:00","MM/DD/YYYY HH:mm"), 
+		arrow.get("01/01/2014 22:00","MM/DD/YYYY HH:mm"), "Day"))
+	day.append(Appt(arrow.get("01/02/2014 09:00","MM/DD/YYYY HH:mm"), 
+		arrow.get("01/02/2014 22:00","MM/DD/YYYY HH:mm"), "Day"))
+	busy = Agenda()
+	busy.append(app3)
+	busy.append(app1)
+	busy.append(app2)
+	
+	solution = Agenda()
+	solution.append(Appt(arrow.get("01/01/2014 09:00","MM/DD/YYYY HH:mm"), a, ""))
+	solution.append(Appt(d, e, ""))
+	solution.append(Appt(f, arrow.get("01/01/2014 22:00","MM/DD/YYYY HH:mm"), ""))
+	solution.append(day.appts[1])
+	
+	assert day.difference(busy) == solution
+	assert len(busy.difference(day)) == 0
+
+def test_working_hours():
+	'''
+	Testing working_hours across a daylight saving change
+	'''
+	nine = datetime.time(9, 0)
+	five = datetime.time(17, 0)
+	hours = working_hours(datetime.date(2016, 11, 5), datetime.date(2016, 11, 7),
+		nine, five, "US/Pacific")
+	
+	assert len(hours) == 3
+	assert hours.appts[0].begin == arrow.get("2016-11-05T09:00:00-07:00")
+	assert hours.appts[2].begin == arrow.get("2016-11-07T09:00:00-08:00")
+	assert hours.appts[2].end == arrow.get("2016-11-07T17:00:00-08:00")
+	
+	# Memoized, but callers get their own agenda
+	hours.appts.pop()
+	again = working_hours(datetime.date(2016, 11, 5), datetime.date(2016, 11, 7),
+		nine, five, "US/Pacific")
+	assert len(again) == 3
+	
+	try:
+		working_hours(datetime.date(2016, 11, 5), datetime.date(2016, 11, 7),
+			five, nine, "US/Pacific")
+		assert False
+	except ValueError:
+		pass
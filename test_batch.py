@@ -0,0 +1,57 @@
+"""
+Nose test suite for batch.py
+"""
+
+import shutil
+import tempfile
+
+import arrow
+from batch import *
+
+def test_daily_windows():
+	'''
+	Testing batch.daily_windows across a daylight saving change
+	'''
+	windows = daily_windows("11/05/2016 - 11/07/2016", "09:00", "17:00",
+		"US/Pacific")
+	assert len(windows) == 3
+	assert windows[0][0] == arrow.get("2016-11-05T09:00:00-07:00").timestamp
+	assert windows[2][0] == arrow.get("2016-11-07T09:00:00-08:00").timestamp
+	assert windows[1][1] - windows[1][0] == 8 * 3600
+
+def test_compute():
+	'''
+	Testing batch.compute with a small pool
+	'''
+	windows = [(0, 100), (200, 300)]
+	calendars = [
+		("a", [(10, 20), (250, 400)]),
+		("b", pack_intervals([(15, 30)])),
+		("c", []),
+	]
+	free, common = compute(calendars, windows, processes=2)
+	assert free["a"] == [(0, 10), (20, 100), (200, 250)]
+	assert free["b"] == [(0, 15), (30, 100), (200, 300)]
+	assert free["c"] == windows
+	assert common == [(0, 10), (30, 100), (200, 250)]
+
+def test_stored_busy():
+	'''
+	Testing batch.stored_busy only answers for ranges the store covers
+	'''
+	directory = tempfile.mkdtemp()
+	try:
+		store = BusyStore(directory)
+		store.update("a", [(10, 20), (250, 260)], [(0, 300)])
+		store.update("b", [(50, 60)], [(0, 100)])
+		calendars = stored_busy(store, ["a"], [(0, 100), (200, 300)])
+		assert list(iter_packed(calendars[0][1])) == [(10, 20), (250, 260)]
+		try:
+			stored_busy(store, ["a", "b", "never"], [(0, 100), (200, 300)])
+		except ValueError as error:
+			assert str(error).endswith(": b, never")
+		else:
+			assert False, "uncovered calendars must not read as free"
+		store.close()
+	finally:
+		shutil.rmtree(directory)
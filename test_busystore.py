@@ -0,0 +1,66 @@
+"""
+Nose test suite for busystore.py
+"""
+
+import shutil
+import tempfile
+
+import arrow
+from busystore import *
+
+def test_interval_helpers():
+	'''
+	Testing normalize_intervals, subtract_intervals and intersect_intervals
+	'''
+	assert normalize_intervals([(5, 8), (1, 3), (2, 4), (8, 9), (6, 6)]) == \
+		[(1, 4), (5, 9)]
+	assert subtract_intervals([(0, 10), (12, 20)], [(2, 4), (8, 14)]) == \
+		[(0, 2), (4, 8), (14, 20)]
+	assert intersect_intervals([(0, 10), (12, 20)], [(5, 14), (18, 30)]) == \
+		[(5, 10), (12, 14), (18, 20)]
+
+def test_busystore():
+	'''
+	Testing BusyStore updates and range queries
+	'''
+	directory = tempfile.mkdtemp()
+	try:
+		store = BusyStore(directory)
+		assert list(store.intervals("nobody", 0, 100)) == []
+		assert not store.covers("nobody", 0, 100)
+		
+		store.update("cal", [(10, 20), (30, 40), (50, 60)], [(0, 100)])
+		assert list(store.intervals("cal", 15, 55)) == \
+			[(15, 20), (30, 40), (50, 55)]
+		assert list(store.intervals("cal", 20, 30)) == []
+		
+		# A later fetch replaces only what it covered
+		store.update("cal", [(35, 45)], [(25, 48)])
+		assert list(store.intervals("cal", 0, 100)) == \
+			[(10, 20), (35, 45), (50, 60)]
+		
+		# Free only where a fetch has looked
+		store.update("other", [(110, 120)], [(100, 150), (200, 250)])
+		assert store.covers("other", 100, 150)
+		assert store.covers("other", 210, 220)
+		assert not store.covers("other", 140, 210)
+		assert not store.covers("other", 50, 120)
+		assert not store.covers("other", 240, 260)
+		store.update("other", [ ], [(150, 200)])
+		assert store.covers("other", 100, 250)
+		assert list(store.intervals("other", 0, 300)) == [(110, 120)]
+		
+		# A reader in progress keeps seeing the file it started on
+		reader = store.intervals("cal", 0, 100)
+		assert next(reader) == (10, 20)
+		store.update("cal", [(70, 80)], [(60, 90)])
+		assert list(store.intervals("cal", 60, 100)) == [(70, 80)]
+		assert list(reader) == [(35, 45), (50, 60)]
+		
+		begin = arrow.get(0)
+		agenda = store.agenda("cal", begin, begin.replace(seconds=+100), tz="UTC")
+		assert len(agenda) == 4
+		assert agenda.appts[1].begin == arrow.get(35)
+		store.close()
+	finally:
+		shutil.rmtree(directory)
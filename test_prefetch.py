@@ -0,0 +1,110 @@
+"""
+Nose test suite for prefetch.py
+"""
+
+import threading
+import time
+
+from prefetch import *
+
+def test_ttlcache():
+	'''
+	Testing TTLCache expiry and size bound
+	'''
+	cache = TTLCache(maxsize=2, ttl=60)
+	cache.put("a", 1)
+	cache.put("b", 2)
+	assert cache.get("a") == 1
+	cache.put("c", 3)          # evicts "b", the least recently used
+	assert cache.get("b") is None
+	assert cache.get("a") == 1 and cache.get("c") == 3
+	
+	cache = TTLCache(ttl=0)
+	cache.put("a", 1)
+	time.sleep(0.01)
+	assert cache.get("a", "gone") == "gone"
+
+def test_prefetcher_cancel():
+	'''
+	Testing that a new job for the same owner cancels the old one
+	'''
+	prefetcher = Prefetcher(max_jobs=1)
+	started = threading.Event()
+	seen = []
+	
+	def slow(cancelled, name):
+		started.set()
+		cancelled.wait(5)
+		seen.append((name, cancelled.is_set()))
+	
+	prefetcher.submit("session", slow, "first")
+	started.wait(5)
+	queued = prefetcher.submit("other", slow, "queued")
+	prefetcher.submit("other", slow, "replacement")
+	prefetcher.submit("session", slow, "second")
+	prefetcher.cancel("other")
+	prefetcher.cancel("session")
+	prefetcher.shutdown()
+	
+	assert queued.cancelled()
+	assert seen[0] == ("first", True)
+	assert ("queued", False) not in seen
+
+def test_ttlcache_fetch():
+	'''
+	Testing that TTLCache.fetch waits for keys another fetch is loading
+	'''
+	cache = TTLCache(ttl=60)
+	loads = []
+	started = threading.Event()
+	release = threading.Event()
+	
+	def load(keys):
+		loads.append(keys)
+		started.set()
+		release.wait(5)
+		return {key: key.upper() for key in keys}
+	
+	# A prefetch of every calendar, and a click on some of them
+	# arriving while it is still in flight
+	prefetch = threading.Thread(target=cache.fetch, args=(["a", "b", "c"], load))
+	prefetch.start()
+	started.wait(5)
+	click = []
+	clicker = threading.Thread(
+		target=lambda: click.append(cache.fetch(["b", "c"], load)))
+	clicker.start()
+	time.sleep(0.05)
+	assert clicker.is_alive()
+	release.set()
+	prefetch.join(5)
+	clicker.join(5)
+	assert click == [{"b": "B", "c": "C"}]
+	assert loads == [["a", "b", "c"]]
+	assert cache.fetch(["a", "d"], load) == {"a": "A", "d": "D"}
+	assert loads[1:] == [["d"]]
+	
+	# Keys whose load failed elsewhere are loaded again
+	started.clear()
+	release.clear()
+	def failing(keys):
+		started.set()
+		release.wait(5)
+		raise RuntimeError("upstream error")
+	def failed_prefetch():
+		try:
+			cache.fetch(["e"], failing)
+		except RuntimeError:
+			pass
+	prefetch = threading.Thread(target=failed_prefetch)
+	prefetch.start()
+	started.wait(5)
+	click = []
+	clicker = threading.Thread(
+		target=lambda: click.append(cache.fetch(["e"], load)))
+	clicker.start()
+	time.sleep(0.05)
+	release.set()
+	prefetch.join(5)
+	clicker.join(5)
+	assert click == [{"e": "E"}]
@@ -0,0 +1,73 @@
+"""
+Nose test suite for scheduler.py
+"""
+
+import threading
+import time
+
+from scheduler import *
+
+def test_collapse():
+	'''
+	Testing that identical concurrent calls share one upstream call
+	'''
+	scheduler = CallScheduler()
+	release = threading.Event()
+	upstream = []
+	results = []
+	
+	def fetch():
+		upstream.append(1)
+		release.wait(5)
+		return "busy times"
+	
+	def caller():
+		results.append(scheduler.call(("freebusy", "cal"), fetch))
+	
+	threads = [threading.Thread(target=caller) for i in range(5)]
+	for thread in threads:
+		thread.start()
+	time.sleep(0.1)
+	release.set()
+	for thread in threads:
+		thread.join()
+	
+	assert upstream == [1]
+	assert results == ["busy times"] * 5
+	# Not in flight any more, so a new call goes upstream
+	assert scheduler.call(("freebusy", "cal"), lambda: "fresh") == "fresh"
+
+def test_collapse_error():
+	'''
+	Testing that an upstream error reaches the caller
+	'''
+	scheduler = CallScheduler()
+	def fail():
+		raise IOError("quota exceeded")
+	try:
+		scheduler.call("key", fail)
+		assert False
+	except IOError:
+		pass
+
+def test_priority():
+	'''
+	Testing the token bucket and interactive-before-background order
+	'''
+	scheduler = CallScheduler(rate=20, burst=1)
+	scheduler.call("first", lambda: None)     # empties the bucket
+	order = []
+	
+	def caller(key, priority):
+		scheduler.call(key, lambda: order.append(key), priority)
+	
+	background = threading.Thread(target=caller, args=("prefetch", BACKGROUND))
+	interactive = threading.Thread(target=caller, args=("click", INTERACTIVE))
+	started = time.monotonic()
+	background.start()
+	interactive.start()
+	background.join()
+	interactive.join()
+	
+	assert order == ["click", "prefetch"]
+	assert time.monotonic() - started >= 0.08